@@ -9,16 +9,24 @@ New in version 3.0:
 Redesgned interface: refEntry is Textbox; Vertical layout
 """
 
+import time
+startTime = time.perf_counter()
 from tkinter import *
 from tkinter.ttk import *
 from tkinter import messagebox
-from reference import *
+from reference import (BOM,Reference,extractDenomination, #Not *: it would
+                       tablesLoaded,waitTables)            #wait for tables
+import reference
+importTime = time.perf_counter() - startTime
 
 """Globals:
-      RLDS, LDS: Tables with (book,chaper:verse) triples
       BOM: BookNames,StyleList, Abbreviations, etc.
+      RLDS, LDS tables load in the background; see reference.waitTables.
+      startupLog: File that startup times are appended to
 """
 
+startupLog = "ReferenceStartup.log"
+
 
 class ReferenceApp(Frame):
     def __init__(self,master=None):
@@ -38,7 +46,9 @@ class ReferenceApp(Frame):
         self.rldstyle = StringVar()     #Combobox control
         self.ldstyle = StringVar()      #Combobox control
         
+        widgetStart = time.perf_counter()
         self.createWidgets()
+        self.widgetTime = time.perf_counter() - widgetStart
         
         #initialize variables
             #Entry/Output
@@ -53,6 +63,28 @@ class ReferenceApp(Frame):
             "write",lambda a,b,c,x="RLDS":self.applyStyle(x)) #Magic
         self.ldstyle.trace_add(
             "write",lambda a,b,c,x="LDS":self.applyStyle(x))  #Magic
+        self.after_idle(self.firstWindow)
+
+
+    def firstWindow(self):
+        self.windowTime = time.perf_counter() - startTime
+        self.startupReport()
+
+    def startupReport(self):
+        """Append startup times to startupLog once the tables have loaded."""
+        if not tablesLoaded():
+            self.after(50,self.startupReport)
+            return
+        s = "{} import {:.3f}s widgets {:.3f}s first window {:.3f}s " + \
+            "tables {:.3f}s (background)\n"
+        s = s.format(time.strftime("%Y-%m-%d %H:%M:%S"),importTime,
+                     self.widgetTime,self.windowTime,reference.loadTime)
+        try:
+            with open(startupLog,"a") as logFile:
+                logFile.write(s)
+        except OSError:
+            pass                        #Never keep the kiosk from starting
+        if reference.debug: print(s,end="")
 
 
     def createWidgets(self):
@@ -201,6 +233,18 @@ class ReferenceApp(Frame):
         self.refEntry.focus_set()
 
     def submit(self,*args):  #sometimes an event is passed.
+        if not tablesLoaded():          #Converted before tables were ready
+            self.master.config(cursor="watch")
+            self.update_idletasks()
+        try:
+            waitTables()
+        except Exception:               #Not the user's fault: report apart
+            s = "The conversion tables could not be loaded.\n{}".format(
+                reference.loadError)
+            messagebox.showerror("Table Error", s)
+            return
+        finally:
+            self.master.config(cursor="")
         try:
             ref = self.refEntry.get()
             den,s = extractDenomination(ref)
@@ -5,15 +5,54 @@ Date: September 5, 2020
 Converts scripture references from RLDS to LDS and vice versa.
 """
 
+import threading
+import time
+from bisect import bisect_right
+
+
+__all__ = ["IntRange","BookNames","Reference","RefString","ConversionDB",
+           "initializeGlobals","loadTables","tablesLoaded","waitTables",
+           "getTables","getRuns","exportTables","extractDenomination",
+           "debug","loadTime","loadError","BOM","RLDS","LDS","RUNS"]
 
 debug = False
+loadTime = None         #Seconds loadTables took; None until finished
+loadError = None        #Exception raised in loadTables, if any
 
 def initializeGlobals():
-    global BOM,RLDS,LDS
+    """Create BOM now; load RLDS,LDS,RUNS in tableThread. See waitTables.
+       Reading reference.RLDS (or a * import) waits for the tables."""
+    global BOM,tableThread
     BOM = BookNames()
-    inFile = open("BoMConversion.txt","r")
-    RLDS,LDS = getTables(inFile)
-    inFile.close()
+    tableThread = threading.Thread(target=loadTables,daemon=True)
+    tableThread.start()
+
+def loadTables():
+    global RLDS,LDS,RUNS,loadTime,loadError
+    start = time.perf_counter()
+    try:
+        with open("BoMConversion.txt","r") as inFile:
+            RLDS,LDS = getTables(inFile)
+        RUNS = {"RLDS":getRuns(RLDS),"LDS":getRuns(LDS)}
+    except Exception as e:
+        loadError = e
+    loadTime = time.perf_counter() - start
+
+def tablesLoaded():
+    return not tableThread.is_alive()
+
+def waitTables():
+    """Block until loadTables is finished; re-raise its error, if any."""
+    tableThread.join()
+    if loadError is not None:
+        raise loadError
+
+def __getattr__(name):
+    """Wait for tableThread before handing out RLDS, LDS or RUNS."""
+    if name in ("RLDS","LDS","RUNS"):
+        waitTables()
+        return globals()[name]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,name))
 
 class IntRange(list):
     """List of inclusive integer ranges [a,b] with a <= b.
@@ -51,17 +90,27 @@ class BookNames():
         ldstyle       int      Default for LDS references (chosen by user)
         nameList      list     Book names indexed by [book,style] integers
         nameDict      dict     Book Numbers indexed by hashed abbreviation
+        gramIndex     dict     Sets of nameDict keys indexed by bigram
+        minScore      float    Least score resolve() accepts as a match
+        parseScore    float    Least score RefString accepts; stricter
+        numerals      list     (prefix,digit) for numbered Nephi books
 
         METHOD             COMMENT
         bookNum(s)         Book str to int 1Nephi=1 ... Moroni=15
+        resolve(s,minScore) Book str to (int,score), tolerating typos
         spell(s,style)     Bootk str <s> to str with style number <style>
         setStyle(den,style) Sets default for denomination to style number
-        bookStr(s,styleNo) Rewrite str w/ style number w/o error correnction
+        bookStr(s,styleNo) Rewrite str w/ style number, correcting book names
 
         PRIVATE METHODS    COMMENT
         chunk(s)           Splits str into strings of alpha, digit, non-blank
         bigChunk(s)        Combines chunks for book name lookup
+        numberedNephi(b,c) True if chunks b,c join to a numbered Nephi
+        splitName(b,c)     True if chunks b,c join to a better book name
         hsh (s)            Simple hash function for nameDict
+        numeral(key)       Rewrite I/II/First/1st... Nephi keys with a digit
+        grams(key)         Bigrams of a hashed name for gramIndex
+        distance(a,b,bound) Edit distance of a,b, capped at bound+1
     """
     
     def __init__(self,rldstyle=1,ldstyle=3):    #Default styles: RLDS 1908,LDS 1951
@@ -70,7 +119,13 @@ class BookNames():
         self.ldstyle = ldstyle      #index to styleList: Output style for LDS refs
         self.nameList = None        #For name output. Filled below
         self.nameDict = {}          #name input->book num. Filled below
-        self.hsh = lambda x: x.replace(" ","").replace(".","").upper()
+        self.gramIndex = {}         #bigram->set of nameDict keys. Filled below
+        self.minScore = 0.75        #resolve() rejects poorer matches
+        self.parseScore = 0.8       #RefString rejects poorer matches
+        self.numerals = [("FOURTH","4"),("SECOND","2"),("FIRST","1"),
+                         ("THIRD","3"),("1ST","1"),("2ND","2"),("3RD","3"),
+                         ("4TH","4"),("III","3"),("IV","4"),("II","2"),("I","1")]
+        self.hsh = lambda x: self.numeral(x.replace(" ","").replace(".","").upper())
 
         long = "1 Nephi,2 Nephi,Jacob,Enos,Jarom,Omni,Words of Mormon,Mosiah," + \
                "Alma,Helaman,3 Nephi,4 Nephi,Mormon,Ether,Moroni"
@@ -89,12 +144,9 @@ class BookNames():
             for j in range(len(self.nameList[i])):
                 name = self.nameList[i][j]
                 self.nameDict[self.hsh(name)] = j+1
-        N1 = [(num + name,1) for num in ["FIRST","1ST"] for name in ["N","NE","NEPHI"]]
-        N2 = [(num + name,2) for num in ["SECOND","2ND"] for name in ["N","NE","NEPHI"]]
-        N3 = [(num + name,11) for num in ["THIRD","3RD"] for name in ["N","NE","NEPHI"]]
-        N4 = [(num + name,12) for num in ["FOURTH","4TH"] for name in ["N","NE","NEPHI"]]
-        for name,n in N1+N2+N3+N4:
-            self.nameDict[name]=n
+        for key in self.nameDict:
+            for g in self.grams(key):
+                self.gramIndex.setdefault(g,set()).add(key)
           
 
     def __str__(self):
@@ -112,6 +164,68 @@ class BookNames():
             return self.nameDict[self.hsh(s)]
         return 0
 
+    def numeral(self,key):
+        """Rewrite a leading roman numeral or ordinal of a Nephi as a digit"""
+        for prefix,digit in self.numerals:
+            if key.startswith(prefix) and key[len(prefix):len(prefix)+1] == "N":
+                return digit + key[len(prefix):]
+        return key
+
+    def resolve(self,s,minScore=None):
+        """Return (bookNum,score) for s, tolerating typos and truncation.
+           score is 1.0 for an exact hit; bookNum is 0 if score < minScore,
+           which defaults to self.minScore."""
+        if minScore is None:
+            minScore = self.minScore
+        key = self.hsh(s)
+        if key in self.nameDict:                #Common case: exact
+            return self.nameDict[key],1.0
+        if len(key) < 2 or not any(c.isalpha() for c in key):
+            return 0,0.0
+        candidates = set()
+        for g in self.grams(key):
+            candidates |= self.gramIndex.get(g,set())
+        books = {self.nameDict[k] for k in candidates if k.startswith(key)}
+        if len(key) >= 3 and len(books) == 1:  #Unique truncation, e.g. HELAM
+            return books.pop(),0.9
+        bound = len(key)//4 + 1
+        best,score = 0,0.0
+        for k in candidates:
+            d = self.distance(key,k,bound)
+            if d > bound:
+                continue
+            t = 1 - d/max(len(key),len(k))
+            if t > score:
+                best,score = self.nameDict[k],t
+            elif t == score and self.nameDict[k] != best:
+                best = 0                        #Ambiguous
+        if best == 0 or score < minScore:
+            return 0,score
+        return best,score
+
+    def grams(self,key):
+        """Return the bigrams of key, padded with ^ and $"""
+        key = "^" + key + "$"
+        return [key[i:i+2] for i in range(len(key)-1)]
+
+    def distance(self,a,b,bound):
+        """Edit distance (with transpositions) of a,b; bound+1 if larger."""
+        if abs(len(a)-len(b)) > bound:
+            return bound+1
+        prev2 = None
+        prev = list(range(len(b)+1))
+        for i in range(1,len(a)+1):
+            row = [i] + [0]*len(b)
+            for j in range(1,len(b)+1):
+                cost = 0 if a[i-1] == b[j-1] else 1
+                row[j] = min(prev[j]+1,row[j-1]+1,prev[j-1]+cost)
+                if i > 1 and j > 1 and a[i-1] == b[j-2] and a[i-2] == b[j-1]:
+                    row[j] = min(row[j],prev2[j-2]+1)
+            if min(row) > bound:
+                return bound+1
+            prev2,prev = prev,row
+        return min(prev[-1],bound+1)
+
     def spell(self,book,style = 0):
         return self.nameList[style][book-1]
 
@@ -146,6 +260,10 @@ class BookNames():
                 b = big[-1]
                 if c.upper() in combine:
                     big[-1] = b+c
+                elif self.numberedNephi(b,c):
+                    big[-1] = b+c           #Misspelled numbered book
+                elif self.splitName(b,c):
+                    big[-1] = b+c           #Book name split by a blank
                 elif len(b)>2 and b[-2:].upper() == "OF":
                     big[-1] = b+c
                 else:
@@ -155,12 +273,28 @@ class BookNames():
         return big
             
 
+    def numberedNephi(self,b,c):
+        """True if numeral b and misspelled name c make 1, 2, 3 or 4 Nephi"""
+        if b.upper() not in "1,2,3,4,I,II,III,IV".split(",") or \
+           not c.isalpha() or self.hsh(c) in self.nameDict:
+            return False
+        return self.resolve(b+c)[0] in (1,2,11,12)
+
+    def splitName(self,b,c):
+        """True if alpha chunks b,c resolve better as one name, e.g. Moro ni"""
+        if not (b[-1:].isalpha() and c.isalpha()):
+            return False
+        n,score = self.resolve(b+c)
+        return n > 0 and (self.hsh(b+c) in self.nameDict or
+                          score > self.resolve(b)[1])
+
     def bookStr(self,s,styleNo):
-        """reWrite string s using book style number. No error correction."""
+        """reWrite string s using book style number. Book names are
+           resolved with resolve(), so misspellings are corrected."""
         chunkList = self.bigChunks(s)
         newList = []
         for c in chunkList:
-            n = BOM.bookNum(c)
+            n = BOM.resolve(c)[0]
             if c in ";,":       #Restore <Space> after comma or semicolon
                 c += " "    
             elif  n > 0:        #Translate bookName
@@ -184,6 +318,8 @@ class Reference():
             getDenoinationPtr()                     (book,chapter,verse) list
             insert(s)              String           Insert RefString(s)
             translate()                             Return Reference
+            verses()                                Iterate (book,chapter,verse)
+            runs()                                  Iterate (book,chapter,v0,v1)
 
             PRIVATE METHODS        ARG              COMMENT
             
@@ -225,6 +361,7 @@ class Reference():
         return self.denomination        #Return "LDS" or "RLDS"
 
     def getDenominationPtr(self):
+        waitTables()
         t = {"LDS":LDS,"RLDS":RLDS}
         return t[self.denomination]     #Return pointer to table LDS or RLDS
 
@@ -298,6 +435,35 @@ class Reference():
         t.expand()                                  #Expand uses original denomination
         t.denomination = self.otherDenomination()   #Must follow expansion!
         return t
+
+    def verses(self):
+        """Yield (book,chapter,verse) for each verse in refList, lazily.
+           Repeated table entries are yielded once. Use translate().verses()
+           for the verses in the other denomination."""
+        den = self.getDenominationPtr()
+        previous = None
+        for p0,p1 in self.refList:
+            for p in range(p0,p1+1):
+                if den[p] != previous:
+                    previous = den[p]
+                    yield previous
+
+    def runs(self):
+        """Yield (book,chapter,firstVerse,lastVerse) for refList, lazily.
+           Work is proportional to the number of runs in RUNS, not verses."""
+        den = self.getDenominationPtr()
+        starts = RUNS[self.denomination]
+        for p0,p1 in self.refList:
+            r = bisect_right(starts,p0) - 1
+            while r < len(starts) and starts[r] <= p1:
+                lo = max(p0,starts[r])
+                if r+1 < len(starts):
+                    hi = min(p1,starts[r+1]-1)
+                else:
+                    hi = p1
+                book,chapter,v0 = den[lo]
+                yield (book,chapter,v0,den[hi][2])
+                r += 1
         
 
 def getTables(inFile):
@@ -330,6 +496,142 @@ def getTables(inFile):
                     lTable.append((bookNum,c1,v1))
     return rTable,lTable
 
+def getRuns(table):
+    """Return start indices of runs of consecutive verses in table.
+       A run is a maximal stretch of one (book,chapter) whose verses
+       increase by 0 or 1 from entry to entry."""
+    starts = [0] if table else []
+    for i in range(1,len(table)):
+        b0,c0,v0 = table[i-1]
+        b1,c1,v1 = table[i]
+        if (b0,c0) != (b1,c1) or v1 - v0 not in (0,1):
+            starts.append(i)
+    return starts
+
+def exportTables(path="BoMConversion.db"):
+    """Write RLDS and LDS to SQLite table verse(denomination,idx,book,chapter,verse).
+       Rows with equal idx in the two denominations are aligned."""
+    import sqlite3                  #Imported here to keep startup fast
+    waitTables()
+    db = sqlite3.connect(path)
+    with db:
+        db.execute("DROP TABLE IF EXISTS verse")
+        db.execute("CREATE TABLE verse (denomination TEXT, idx INTEGER, " +
+                   "book INTEGER, chapter INTEGER, verse INTEGER, " +
+                   "PRIMARY KEY (denomination,idx)) WITHOUT ROWID")
+        for den,table in (("RLDS",RLDS),("LDS",LDS)):
+            db.executemany("INSERT INTO verse VALUES (?,?,?,?,?)",
+                           ((den,i,b,c,v) for i,(b,c,v) in enumerate(table)))
+        db.execute("CREATE INDEX verse_bcv ON verse " +
+                   "(denomination,book,chapter,verse,idx)")
+    db.close()
+
+class ConversionDB():
+    """Answer translation queries from a database written by exportTables.
+       Results match Reference.translate().verses(): a verse starts at its
+       first idx and, like Reference.expand(), takes in at most 5 repeats.
+
+        ATTRIBUTE     TYPE        COMMENT
+        db            Connection  sqlite3 connection, statements cached
+        sql           dict        Query text by name; reused so sqlite3
+                                  prepares each statement once
+
+        METHOD                    COMMENT
+        index(den,bcv)            First idx of bcv in den, or None
+        translate(den,bcv)        [(book,chapter,verse)] in other denomination
+        translateMany(den,bcvs)   translate() for each of bcvs, batched
+        translateRange(den,a,b)   [(book,chapter,verse)] for range a..b
+        close()                   Close the connection
+    """
+    sql = {
+        "index": "SELECT idx FROM verse WHERE denomination=? " +
+                 "AND book=? AND chapter=? AND verse=? ORDER BY idx",
+        "range": "SELECT book,chapter,verse FROM verse " +
+                 "WHERE denomination=? AND idx BETWEEN ? AND ? ORDER BY idx",
+        "key": "INSERT INTO temp.lookup VALUES (?,?,?,?)",
+        "keyIndex": "SELECT k.n,s.idx FROM temp.lookup k " +
+                 "CROSS JOIN verse s ON s.denomination=? AND s.book=k.book " +
+                 "AND s.chapter=k.chapter AND s.verse=k.verse " +
+                 "ORDER BY k.n,s.idx",
+        "span": "INSERT INTO temp.span VALUES (?,?,?)",
+        "spanRange": "SELECT p.n,o.book,o.chapter,o.verse FROM temp.span p " +
+                 "CROSS JOIN verse o ON o.denomination=? " +
+                 "AND o.idx BETWEEN p.lo AND p.hi ORDER BY p.n,o.idx",
+        }
+
+    def __init__(self,path="BoMConversion.db"):
+        import sqlite3              #Imported here to keep startup fast
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS lookup " +
+                        "(n INTEGER, book INTEGER, chapter INTEGER, verse INTEGER)")
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS span " +
+                        "(n INTEGER, lo INTEGER, hi INTEGER)")
+
+    def close(self):
+        self.db.close()
+
+    def other(self,den):
+        return {"RLDS":"LDS","LDS":"RLDS"}[den]
+
+    def unique(self,rows):
+        """Drop consecutive repeats, as the tables repeat spanned verses"""
+        result = []
+        for row in rows:
+            if not result or result[-1] != row:
+                result.append(row)
+        return result
+
+    def expand(self,p0,p1,same):
+        """Reference.expand(): extend p1 over repeats <same>, within p0+4"""
+        while p1+1 in same and p1+1-p0 < 5:
+            p1 += 1
+        return p1
+
+    def indices(self,den,bcv):
+        rows = self.db.execute(self.sql["index"],(den,)+tuple(bcv))
+        return [idx for (idx,) in rows]
+
+    def index(self,den,bcv):
+        t = self.indices(den,bcv)
+        return t[0] if t else None
+
+    def translate(self,den,bcv):
+        """Translate one verse; ValueError if not found"""
+        return self.translateRange(den,bcv,bcv)
+
+    def translateMany(self,den,bcvList):
+        """Return a list, parallel to bcvList, of translate() results.
+           Unknown verses give []. Both steps are executemany + one join."""
+        same = [[] for bcv in bcvList]
+        result = [[] for bcv in bcvList]
+        with self.db:                   #Empty the temp tables from last call
+            self.db.execute("DELETE FROM temp.lookup")
+            self.db.execute("DELETE FROM temp.span")
+            self.db.executemany(self.sql["key"],
+                ((n,)+tuple(bcv) for n,bcv in enumerate(bcvList)))
+            for n,idx in self.db.execute(self.sql["keyIndex"],(den,)):
+                same[n].append(idx)
+            spans = [(n,t[0],self.expand(t[0],t[0],set(t)))
+                     for n,t in enumerate(same) if t]
+            self.db.executemany(self.sql["span"],spans)
+            rows = self.db.execute(self.sql["spanRange"],(self.other(den),))
+            for n,b,c,v in rows:
+                result[n].append((b,c,v))
+        return [self.unique(t) for t in result]
+
+    def translateRange(self,den,bcv0,bcv1):
+        """Translate the inclusive range bcv0..bcv1; ValueError if not found"""
+        p0 = self.index(den,bcv0)
+        same = self.indices(den,bcv1)
+        if p0 is None or not same:
+            raise ValueError("Reference not in {} table".format(den))
+        p1 = same[0]
+        if p0 > p1:
+            raise ValueError("Decreasing Reference Range.")
+        p1 = self.expand(p0,p1,set(same))
+        rows = self.db.execute(self.sql["range"],(self.other(den),p0,p1))
+        return self.unique(rows.fetchall())
+
 def extractDenomination(s):
     """Return (denomination,remainder)"""
     if "RLDS" in s:
@@ -363,6 +665,8 @@ class RefString():
       Internally, a bcv is an integer tuple (<bookNum>,<chapter>,<verse>).
       Each bcvString is represented by a pair of bcv's with no redundancy.
       Consequently, each ReString is represented internally with a list of bcv pairs with no redundancy.
+      score is the lowest BOM.resolve() score of its book names (1.0 if exact);
+      names scoring below BOM.parseScore become book 0 and fail to insert.
     """
     def __init__(self,s):
         
@@ -382,7 +686,9 @@ class RefString():
                 return (-1,int(bc),int(v))
             b,c = bc.rsplit(" ",1)
             b = b.strip()
-            return (BOM.bookNum(b),int(c),int(v))
+            n,score = BOM.resolve(b,BOM.parseScore)
+            scores.append(score)
+            return (n,int(c),int(v))
 
         def inherit(bcvList,b0=-1,c0=-1,v0=-1):
             if len(bcvList) == 0:
@@ -414,14 +720,17 @@ class RefString():
             return bcvList
 
         #Body of __init__                 
+        scores = []                     #Filled by bcv()
         self.s = s
         self.bcvList = parse(s)
+        self.score = min(scores,default=1.0)
 
     def __str__(self):
         return self.s
 
     def __repr__(self):
-        return "RefString(s:{}, bcvList:{})".format(self.s,self.bcvList)
+        return "RefString(s:{}, bcvList:{}, score:{})".format(
+            self.s,self.bcvList,self.score)
          
     
 initializeGlobals()